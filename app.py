@@ -6,6 +6,8 @@ from dotenv import load_dotenv
 from redis import Redis
 from rq import Queue
 from spaces_utils import SpacesUploader
+from model_registry import TIERS, DEFAULT_TIER, create_registry
+from prediction_runner import recent_batch_metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -26,6 +28,9 @@ queue = Queue(connection=redis_conn)
 # Initialize the Spaces uploader
 spaces_uploader = SpacesUploader()
 
+# Model registry, read-only here; workers record latencies into the same Redis
+model_registry = create_registry(redis_conn)
+
 @app.route('/')
 def serve_index():
     print("Serving index.html from static directory")
@@ -56,10 +61,18 @@ def generate_videos():
         aspect_ratio = str(data.get('aspectRatio', '16:9'))
         duration = int(data.get('duration', 5))
         email = data.get('email')
+        tier = str(data.get('tier', DEFAULT_TIER))
+        hedge = data.get('hedge')  # None falls back to HEDGE_ENABLED in the worker
         
         # Validate inputs
         if not images:
             return jsonify({'error': 'No images provided'}), 400
+
+        if tier not in TIERS:
+            return jsonify({'error': f"Invalid tier, expected one of: {', '.join(TIERS)}"}), 400
+
+        if hedge is not None and not isinstance(hedge, bool):
+            return jsonify({'error': 'Invalid hedge, expected true or false'}), 400
             
         # Convert image data to proper format
         images_data = []
@@ -78,21 +91,41 @@ def generate_videos():
             'prompt': prompt,
             'negative_prompt': negative_prompt,
             'aspect_ratio': aspect_ratio,
-            'duration': duration
+            'duration': duration,
+            'tier': tier,
+            'hedge': hedge
         }
         
+        # Make sure some model can honour these settings before queueing
+        try:
+            model_registry.select(tier, settings)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 400
+
         # Queue the job
         from tasks import process_bulk_videos
         job = queue.enqueue(process_bulk_videos, images_data, settings, email)
         
         return jsonify({
             'status': 'success',
-            'batch_id': job.id
+            'batch_id': job.id,
+            'tier': tier
         })
         
     except Exception as e:
         print(f"Error in generate_videos: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/metrics')
+def get_metrics():
+    try:
+        return jsonify({
+            'models': model_registry.describe(),
+            'batches': recent_batch_metrics(redis_conn)
+        })
+    except Exception as e:
+        print(f"Error in get_metrics: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
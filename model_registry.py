@@ -0,0 +1,256 @@
+import os
+import math
+from collections import defaultdict, deque
+import replicate
+
+# Service tiers accepted by /api/generate and the bulk pipeline
+TIERS = ('fast', 'standard', 'economy')
+DEFAULT_TIER = 'standard'
+
+# How many recent durations to keep per model when computing percentiles
+LATENCY_WINDOW = int(os.getenv('MODEL_LATENCY_WINDOW', 200))
+# Below this many samples we fall back to the model's declared latency
+MIN_LATENCY_SAMPLES = int(os.getenv('MODEL_MIN_LATENCY_SAMPLES', 5))
+# "standard" picks the cheapest model whose p95 is within this factor of the fastest model's p95
+STANDARD_LATENCY_SLACK = float(os.getenv('MODEL_STANDARD_LATENCY_SLACK', 2.0))
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a list of numbers (q in 0-100)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# Values the Kling v1.6 models accept
+KLING_ASPECT_RATIOS = ('16:9', '9:16', '1:1')
+KLING_DURATIONS = (5, 10)
+
+
+def kling_input(image_url, settings):
+    """Map our generation settings onto the Kling v1.6 input schema"""
+    return {
+        "start_image": image_url,
+        "prompt": settings.get('prompt', ''),
+        "negative_prompt": settings.get('negative_prompt', ''),
+        "aspect_ratio": settings.get('aspect_ratio', '16:9'),
+        "duration": int(settings.get('duration', 5)),
+        "cfg_scale": float(settings.get('cfg_scale', 0.5))
+    }
+
+
+def replicate_submit(ref, input):
+    """Create a Replicate prediction without waiting for it to finish"""
+    # Version-less refs (official models such as kling-v1.6-pro) go through
+    # models.predictions.create, available since replicate 0.22.0 which we pin
+    if ':' in ref:
+        return replicate.predictions.create(version=ref.split(':', 1)[1], input=input)
+    return replicate.models.predictions.create(model=ref, input=input)
+
+
+class ModelSpec:
+    """
+    Describes one Replicate model/version we can route to.
+
+    `ref` identifies the model on Replicate ("owner/name" or "owner/name:version"),
+    `build_input` maps (image_url, settings) onto the model's input schema and
+    `latency` holds declared p50/p95/p99 durations in seconds, used until enough
+    live samples have been recorded. `aspect_ratios` / `durations` list the values
+    the model can honour (None means any); the registry never routes a request to a
+    model that would silently ignore its settings. Pass a `submitter` (returns a
+    prediction with id, status, output, error, reload() and cancel()) to swap
+    Replicate out for a local fake in tests.
+    """
+
+    def __init__(self, name, ref, build_input, latency, cost_per_run=0.0,
+                 cost_per_second=0.0, aspect_ratios=None, durations=None,
+                 submitter=None):
+        self.name = name
+        self.ref = ref
+        self.build_input = build_input
+        self.latency = latency
+        self.cost_per_run = cost_per_run
+        self.cost_per_second = cost_per_second
+        self.aspect_ratios = aspect_ratios
+        self.durations = durations
+        self.submitter = submitter or replicate_submit
+
+    def unsupported(self, settings):
+        """Names of requested settings this model cannot honour"""
+        problems = []
+        if self.aspect_ratios is not None and settings.get('aspect_ratio', '16:9') not in self.aspect_ratios:
+            problems.append('aspect_ratio')
+        if self.durations is not None and int(settings.get('duration', 5)) not in self.durations:
+            problems.append('duration')
+        return problems
+
+    def estimate_cost(self, settings):
+        """Estimated USD cost of one prediction with the given settings"""
+        duration = int(settings.get('duration', 5))
+        return self.cost_per_run + self.cost_per_second * duration
+
+    def submit(self, image_url, settings):
+        """Start a prediction and return it without waiting for the output"""
+        return self.submitter(self.ref, input=self.build_input(image_url, settings))
+
+
+class LatencyStats:
+    """
+    Rolling window of observed prediction durations per model.
+
+    Samples are kept in Redis when a connection is given so the web app and
+    every worker see the same numbers; otherwise (or if Redis is unreachable)
+    they are kept in process memory.
+    """
+
+    def __init__(self, redis_conn=None, window=LATENCY_WINDOW):
+        self.redis_conn = redis_conn
+        self.window = window
+        self._local = defaultdict(lambda: deque(maxlen=self.window))
+
+    def _key(self, model_name):
+        return f"model_latency:{model_name}"
+
+    def record(self, model_name, seconds):
+        """Record how long a prediction took"""
+        self._local[model_name].append(float(seconds))
+        if self.redis_conn is None:
+            return
+        try:
+            pipe = self.redis_conn.pipeline()
+            pipe.lpush(self._key(model_name), float(seconds))
+            pipe.ltrim(self._key(model_name), 0, self.window - 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error recording latency for {model_name}: {e}")
+
+    def samples(self, model_name):
+        """Most recent durations for a model, newest first when read from Redis"""
+        if self.redis_conn is not None:
+            try:
+                values = self.redis_conn.lrange(self._key(model_name), 0, self.window - 1)
+                return [float(v) for v in values]
+            except Exception as e:
+                print(f"Error reading latency for {model_name}: {e}")
+        return list(self._local[model_name])
+
+
+class ModelRegistry:
+    """Holds the models we can route to and picks one per service tier"""
+
+    def __init__(self, stats=None):
+        self.stats = stats or LatencyStats()
+        self.models = {}
+
+    def register(self, spec):
+        """Add a model, replacing any existing entry with the same name"""
+        self.models[spec.name] = spec
+        return spec
+
+    def unregister(self, name):
+        self.models.pop(name, None)
+
+    def get(self, name):
+        if name not in self.models:
+            raise KeyError(f"Unknown model: {name}")
+        return self.models[name]
+
+    def latency(self, name, q):
+        """Observed q-th percentile duration, or the declared one if we lack samples"""
+        spec = self.get(name)
+        samples = self.stats.samples(name)
+        if len(samples) >= MIN_LATENCY_SAMPLES:
+            return percentile(samples, q)
+        return spec.latency.get(f"p{q}", spec.latency.get('p95'))
+
+    def record_latency(self, name, seconds):
+        self.stats.record(name, seconds)
+
+    def select(self, tier=DEFAULT_TIER, settings=None):
+        """
+        Pick a model for a tier:
+        fast     - lowest p95 latency
+        economy  - lowest estimated cost (p95 breaks ties)
+        standard - cheapest model whose p95 is within STANDARD_LATENCY_SLACK of the fastest
+        Only models that can honour the requested settings are considered.
+        """
+        if tier not in TIERS:
+            raise ValueError(f"Unknown tier '{tier}', expected one of: {', '.join(TIERS)}")
+        if not self.models:
+            raise LookupError("No models registered")
+
+        settings = settings or {}
+        candidates = [n for n, spec in self.models.items() if not spec.unsupported(settings)]
+        if not candidates:
+            raise LookupError(
+                f"No model supports aspect ratio {settings.get('aspect_ratio', '16:9')} "
+                f"with a {settings.get('duration', 5)}s duration"
+            )
+
+        p95 = {name: self.latency(name, 95) for name in candidates}
+        cost = {name: self.models[name].estimate_cost(settings) for name in candidates}
+
+        if tier == 'fast':
+            name = min(candidates, key=lambda n: (p95[n], cost[n]))
+        elif tier == 'economy':
+            name = min(candidates, key=lambda n: (cost[n], p95[n]))
+        else:
+            budget = min(p95.values()) * STANDARD_LATENCY_SLACK
+            eligible = [n for n in candidates if p95[n] <= budget]
+            name = min(eligible, key=lambda n: (cost[n], p95[n]))
+
+        return self.models[name]
+
+    def describe(self):
+        """Current registry state for logging / status endpoints"""
+        return {
+            name: {
+                'ref': spec.ref,
+                'p50': self.latency(name, 50),
+                'p95': self.latency(name, 95),
+                'p99': self.latency(name, 99),
+                'samples': len(self.stats.samples(name)),
+                'cost_per_run': spec.cost_per_run,
+                'cost_per_second': spec.cost_per_second
+            }
+            for name, spec in self.models.items()
+        }
+
+
+def default_models():
+    """
+    The models we ship with. Declared latencies are seed estimates only and are
+    replaced by live percentiles once MIN_LATENCY_SAMPLES predictions have run.
+    Standard is both cheaper and (by these seeds) faster than pro, so every tier
+    starts on standard; fast only moves to pro if live stats show it quicker.
+    """
+    return [
+        ModelSpec(
+            name='kling-v1.6-standard',
+            ref="kwaivgi/kling-v1.6-standard:7e324e5fcb9479696f15ab6da262390cddf5a1efa2e11374ef9d1f85fc0f82da",
+            build_input=kling_input,
+            latency={'p50': 180, 'p95': 300, 'p99': 420},
+            cost_per_second=0.05,
+            aspect_ratios=KLING_ASPECT_RATIOS,
+            durations=KLING_DURATIONS
+        ),
+        ModelSpec(
+            name='kling-v1.6-pro',
+            ref="kwaivgi/kling-v1.6-pro",
+            build_input=kling_input,
+            latency={'p50': 240, 'p95': 420, 'p99': 600},
+            cost_per_second=0.095,
+            aspect_ratios=KLING_ASPECT_RATIOS,
+            durations=KLING_DURATIONS
+        ),
+    ]
+
+
+def create_registry(redis_conn=None):
+    """Build a registry with the default models and shared latency stats"""
+    registry = ModelRegistry(LatencyStats(redis_conn))
+    for spec in default_models():
+        registry.register(spec)
+    return registry
@@ -0,0 +1,269 @@
+import os
+import json
+import math
+import time
+from model_registry import percentile
+
+# A prediction is considered stuck once it runs longer than p99 * DEADLINE_FACTOR.
+# The headroom matters: we only record durations of predictions that finish, so a
+# deadline of exactly p99 would keep pulling the observed p99 (and itself) down.
+DEADLINE_FACTOR = float(os.getenv('PREDICTION_DEADLINE_FACTOR', 1.5))
+# Never time out faster than this, whatever the stats say
+MIN_DEADLINE = float(os.getenv('PREDICTION_MIN_DEADLINE', 60))
+# How often to poll Replicate for prediction status
+POLL_INTERVAL = float(os.getenv('PREDICTION_POLL_INTERVAL', 2))
+# Times a stuck prediction is cancelled and resubmitted
+MAX_RETRIES = int(os.getenv('PREDICTION_MAX_RETRIES', 1))
+# Once retries or budget run out we keep waiting, but give up at deadline * this factor
+HARD_DEADLINE_FACTOR = float(os.getenv('PREDICTION_HARD_DEADLINE_FACTOR', 4))
+
+# Hedging: instead of cancelling a stuck prediction, race it against a duplicate
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() == 'true'
+# Extra predictions (retries + hedges) allowed per batch, as a fraction of its size
+HEDGE_MAX_FRACTION = float(os.getenv('HEDGE_MAX_FRACTION', 0.1))
+# Extra spend (USD) allowed per batch for retries + hedges
+HEDGE_MAX_COST = float(os.getenv('HEDGE_MAX_COST', 5.0))
+# Extra predictions allowed per minute across all workers, shared through Redis,
+# so concurrent batches together stay inside Replicate's rate limit
+HEDGE_MAX_PER_MINUTE = int(os.getenv('HEDGE_MAX_PER_MINUTE', 20))
+
+# Recent batch summaries kept in Redis for /api/metrics
+BATCH_METRICS_KEY = 'batch_metrics'
+BATCH_METRICS_WINDOW = 100
+
+FINISHED = ('succeeded', 'failed', 'canceled')
+
+
+class PredictionTimeout(Exception):
+    """Raised when a prediction is still running at its hard deadline"""
+
+
+class HedgeBudget:
+    """
+    Caps the extra predictions (retries and hedges) a batch may submit, in count
+    and in estimated cost. With a Redis connection it also enforces
+    HEDGE_MAX_PER_MINUTE across every worker, so concurrent batches together
+    stay inside Replicate's rate limit; if Redis is unreachable only the
+    per-batch caps apply.
+    """
+
+    def __init__(self, max_extra, max_cost=HEDGE_MAX_COST, redis_conn=None,
+                 max_per_minute=HEDGE_MAX_PER_MINUTE):
+        self.max_extra = max_extra
+        self.max_cost = max_cost
+        self.redis_conn = redis_conn
+        self.max_per_minute = max_per_minute
+        self.used = 0
+        self.spent = 0.0
+
+    @classmethod
+    def for_batch(cls, size, redis_conn=None):
+        return cls(max(1, math.ceil(size * HEDGE_MAX_FRACTION)), redis_conn=redis_conn)
+
+    def _take_shared(self):
+        """Claim one slot in the cross-worker per-minute window"""
+        if self.redis_conn is None:
+            return True
+        key = f"hedge_budget:{int(time.time() // 60)}"
+        try:
+            pipe = self.redis_conn.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, 120)
+            count = pipe.execute()[0]
+            if count > self.max_per_minute:
+                self.redis_conn.decr(key)
+                return False
+        except Exception as e:
+            print(f"Error checking shared hedge budget: {e}")
+        return True
+
+    def take(self, cost):
+        """Reserve room for one extra prediction, returns False if over budget"""
+        if self.used >= self.max_extra or self.spent + cost > self.max_cost:
+            return False
+        if not self._take_shared():
+            return False
+        self.used += 1
+        self.spent += cost
+        return True
+
+    def release(self, cost):
+        """Give back a reservation whose submission never went through"""
+        self.used -= 1
+        self.spent -= cost
+
+
+class BatchMetrics:
+    """Completion times and tail-latency interventions for one batch"""
+
+    def __init__(self, batch_id, hedging=False):
+        self.batch_id = batch_id
+        self.hedging = hedging
+        self.job_seconds = []
+        self.timeouts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_refusals = 0
+        self.extra_cost = 0.0
+
+    def record_job(self, seconds):
+        self.job_seconds.append(seconds)
+
+    def summary(self):
+        return {
+            'batch_id': self.batch_id,
+            'hedging': self.hedging,
+            'jobs': len(self.job_seconds),
+            'p50_seconds': percentile(self.job_seconds, 50),
+            'p99_seconds': percentile(self.job_seconds, 99),
+            'max_seconds': max(self.job_seconds) if self.job_seconds else None,
+            'timeouts': self.timeouts,
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'budget_refusals': self.budget_refusals,
+            'extra_cost': round(self.extra_cost, 4)
+        }
+
+    def publish(self, redis_conn):
+        """Push the summary onto the rolling list served by /api/metrics"""
+        try:
+            pipe = redis_conn.pipeline()
+            pipe.lpush(BATCH_METRICS_KEY, json.dumps(self.summary()))
+            pipe.ltrim(BATCH_METRICS_KEY, 0, BATCH_METRICS_WINDOW - 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error publishing batch metrics: {e}")
+
+
+def recent_batch_metrics(redis_conn, limit=BATCH_METRICS_WINDOW):
+    """Most recent batch summaries, newest first"""
+    return [json.loads(m) for m in redis_conn.lrange(BATCH_METRICS_KEY, 0, limit - 1)]
+
+
+def hedging_enabled(settings):
+    """Per-request `hedge` setting, falling back to HEDGE_ENABLED"""
+    hedge = settings.get('hedge')
+    return HEDGE_ENABLED if hedge is None else bool(hedge)
+
+
+def deadline_for(registry, model):
+    """Seconds a prediction on this model may run before we treat it as stuck"""
+    return max(MIN_DEADLINE, registry.latency(model.name, 99) * DEADLINE_FACTOR)
+
+
+def _cancel(prediction):
+    try:
+        prediction.cancel()
+    except Exception as e:
+        print(f"Error cancelling prediction {getattr(prediction, 'id', '?')}: {e}")
+
+
+def run_with_deadline(model, registry, image_url, settings, budget=None, metrics=None,
+                      hedge=HEDGE_ENABLED, clock=time.monotonic, sleep=time.sleep):
+    """
+    Run a prediction, intervening once it exceeds the model's deadline.
+
+    A stuck prediction is cancelled and resubmitted (up to MAX_RETRIES), or with
+    `hedge` a duplicate is started alongside it and whichever finishes first wins,
+    the other being cancelled. Every extra submission must fit in `budget`; when
+    none can be afforded we keep waiting rather than cancel, up to the hard
+    deadline. Returns the prediction output and records its duration in the registry.
+    """
+    budget = budget or HedgeBudget(MAX_RETRIES + 1)
+    deadline = deadline_for(registry, model)
+    hard_deadline = deadline * HARD_DEADLINE_FACTOR
+    extra_cost = model.estimate_cost(settings)
+    retries = 0
+
+    primary = model.submit(image_url, settings)
+    attempt_started = last_submitted = clock()
+    active = [(primary, attempt_started)]
+    hedged = False
+    waiting = False
+    last_error = None
+
+    try:
+        while True:
+            for prediction, started in list(active):
+                prediction.reload()
+                if prediction.status == 'succeeded':
+                    registry.record_latency(model.name, clock() - started)
+                    for other, _ in active:
+                        if other is not prediction:
+                            _cancel(other)
+                    if hedged and metrics and prediction is not primary:
+                        metrics.hedge_wins += 1
+                    return prediction.output
+                if prediction.status in FINISHED:
+                    last_error = prediction.error or f"Prediction {prediction.status}"
+                    active.remove((prediction, started))
+
+            if not active:
+                raise Exception(last_error)
+
+            # The newest submission decides whether we are still within the deadline, even if
+            # it has since failed: a dead hedge shouldn't get the primary cancelled straight away
+            now = clock()
+            if not waiting and now - last_submitted > deadline:
+                # Every overrun counts, whether we hedge, retry or wait it out
+                if metrics:
+                    metrics.timeouts += 1
+                if hedge and not hedged and budget.take(extra_cost):
+                    print(f"⏱️ Prediction {primary.id} on {model.name} exceeded {deadline:.0f}s, hedging")
+                    try:
+                        hedge_prediction = model.submit(image_url, settings)
+                    except Exception as e:
+                        # Most likely rate limited; the primary is still healthy, so just keep waiting on it
+                        print(f"Error submitting hedge for {model.name}, waiting on the primary: {e}")
+                        budget.release(extra_cost)
+                        waiting = True
+                    else:
+                        last_submitted = clock()
+                        active.append((hedge_prediction, last_submitted))
+                        hedged = True
+                        if metrics:
+                            metrics.hedges += 1
+                            metrics.extra_cost += extra_cost
+                elif retries < MAX_RETRIES and budget.take(extra_cost):
+                    # Submit the replacement before cancelling anything, so a failed resubmit
+                    # leaves us waiting on a slow prediction rather than with none at all
+                    try:
+                        replacement = model.submit(image_url, settings)
+                    except Exception as e:
+                        print(f"Error resubmitting {model.name} prediction, waiting on the current one: {e}")
+                        budget.release(extra_cost)
+                        waiting = True
+                    else:
+                        retries += 1
+                        print(f"🔁 Prediction on {model.name} stuck beyond {deadline:.0f}s, "
+                              f"cancelling and retrying ({retries}/{MAX_RETRIES})")
+                        for prediction, _ in active:
+                            _cancel(prediction)
+                        if metrics:
+                            metrics.retries += 1
+                            metrics.extra_cost += extra_cost
+                        primary = replacement
+                        attempt_started = last_submitted = clock()
+                        active = [(primary, attempt_started)]
+                        hedged = False
+                        last_error = None
+                else:
+                    # Nothing left to spend: cancelling now would only turn a slow job into a failed one
+                    print(f"⏱️ Prediction on {model.name} stuck beyond {deadline:.0f}s, no retry budget left, "
+                          f"waiting up to {hard_deadline:.0f}s")
+                    waiting = True
+                    if metrics:
+                        metrics.budget_refusals += 1
+
+            if now - attempt_started > hard_deadline:
+                raise PredictionTimeout(f"{model.name} prediction exceeded {hard_deadline:.0f}s hard deadline")
+
+            sleep(POLL_INTERVAL)
+    except BaseException:
+        # Whatever went wrong (hard deadline, a reload() network error, a failed
+        # submit), don't leave paid predictions running on Replicate
+        for prediction, _ in active:
+            _cancel(prediction)
+        raise
@@ -100,6 +100,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const aspectRatio = document.getElementById('aspectRatio').value;
         const duration = parseInt(document.getElementById('duration').value);
         const email = document.getElementById('notification_email').value;
+        const tier = document.getElementById('tier').value;
 
         generateBtn.disabled = true;
         statusDiv.textContent = 'Starting video generation...';
@@ -117,7 +118,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     aspectRatio,
                     duration,
                     cfg_scale: 0.5,
-                    email
+                    email,
+                    tier
                 })
             });
 
@@ -1,7 +1,10 @@
 import os
 import base64
-import replicate
+import time
+from redis import Redis
 from spaces_utils import SpacesUploader
+from model_registry import create_registry, DEFAULT_TIER
+from prediction_runner import run_with_deadline, HedgeBudget, BatchMetrics, hedging_enabled
 from flask_mail import Mail, Message
 import json
 from datetime import datetime
@@ -9,6 +12,11 @@ from datetime import datetime
 # Initialize the Spaces uploader
 spaces_uploader = SpacesUploader()
 
+# Models we can route to, with latency stats shared through Redis.
+# Tests can swap this for a registry holding a local fake model.
+redis_conn = Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+model_registry = create_registry(redis_conn)
+
 def save_job_status(job_id, status, data=None):
     """Save job status to a JSON file"""
     status_file = os.path.join('output', 'job_status.json')
@@ -32,9 +40,10 @@ def save_job_status(job_id, status, data=None):
     except Exception as e:
         print(f"Error saving job status: {e}")
 
-def process_video(image_url, settings, job_id, notification_email=None):
+def process_video(image_url, settings, job_id, notification_email=None, budget=None, metrics=None):
     """
-    Background task to process a video
+    Background task to process a video.
+    Stuck predictions are cancelled and retried (or hedged) within `budget`.
     """
     try:
         save_job_status(job_id, 'processing', {
@@ -42,17 +51,18 @@ def process_video(image_url, settings, job_id, notification_email=None):
             'progress': 0
         })
 
-        # Generate video using Replicate
-        output = replicate.run(
-            "kwaivgi/kling-v1.6-standard:7e324e5fcb9479696f15ab6da262390cddf5a1efa2e11374ef9d1f85fc0f82da",
-            input={
-                "start_image": image_url,  # Pass the URL directly
-                "prompt": settings.get('prompt', ''),
-                "negative_prompt": settings.get('negative_prompt', ''),
-                "aspect_ratio": settings.get('aspect_ratio', '16:9'),
-                "duration": int(settings.get('duration', 5)),
-                "cfg_scale": float(settings.get('cfg_scale', 0.5))
-            }
+        # Route to a model for the requested tier and generate the video
+        model = model_registry.select(settings.get('tier', DEFAULT_TIER), settings)
+        print(f"🎬 Job {job_id} routed to {model.name} ({settings.get('tier', DEFAULT_TIER)} tier)")
+
+        output = run_with_deadline(
+            model,
+            model_registry,
+            image_url,
+            settings,
+            budget=budget,
+            metrics=metrics,
+            hedge=hedging_enabled(settings)
         )
 
         if output:
@@ -70,7 +80,8 @@ def process_video(image_url, settings, job_id, notification_email=None):
             if spaces_url:
                 result = {
                     'message': 'Video generated and uploaded successfully!',
-                    'video_url': spaces_url
+                    'video_url': spaces_url,
+                    'model': model.name
                 }
                 save_job_status(job_id, 'completed', result)
 
@@ -96,13 +107,21 @@ def process_video(image_url, settings, job_id, notification_email=None):
         save_job_status(job_id, 'failed', {'error': error})
         return {'error': error}
 
-def process_bulk_videos(images_data, settings, notification_email=None):
+def process_bulk_videos(images_data, settings, notification_email=None, tier=None):
     """
-    Process multiple videos in sequence
+    Process multiple videos in sequence.
+    `tier` (fast, standard, economy) overrides settings['tier'] when given.
     """
+    if tier:
+        settings = dict(settings, tier=tier)
+
     results = []
     total = len(images_data)
     batch_id = base64.urlsafe_b64encode(os.urandom(6)).decode('ascii')
+
+    # Retries and hedges share one budget per batch, plus a per-minute cap across workers
+    budget = HedgeBudget.for_batch(total, redis_conn)
+    metrics = BatchMetrics(batch_id, hedging=hedging_enabled(settings))
     
     for idx, image_data in enumerate(images_data):
         job_id = f"bulk_{batch_id}_{idx}"
@@ -128,13 +147,18 @@ def process_bulk_videos(images_data, settings, notification_email=None):
             if not image_url:
                 raise ValueError("No valid image URL provided")
                 
-            # Process the video
+            # Process the video; only these jobs count towards batch completion times,
+            # rejected inputs would finish in ~0s and drag the percentiles down
+            started = time.monotonic()
             result = process_video(
                 image_url,
                 image_settings,
                 job_id,
-                notification_email
+                notification_email,
+                budget=budget,
+                metrics=metrics
             )
+            metrics.record_job(time.monotonic() - started)
             results.append({
                 'job_id': job_id,
                 'filename': image_settings['filename'],
@@ -147,6 +171,21 @@ def process_bulk_videos(images_data, settings, notification_email=None):
                 'filename': image_settings['filename'],
                 'error': str(e)
             })
+
+    # Record batch completion times so tail-latency changes show up in /api/metrics
+    summary = metrics.summary()
+    summary['failed'] = sum(1 for r in results if 'error' in r or 'error' in r.get('result', {}))
+    summary['rejected'] = total - summary['jobs']
+    print(f"📊 Batch {batch_id}: p50 {summary['p50_seconds']}s, p99 {summary['p99_seconds']}s, "
+          f"{summary['timeouts']} timeouts, {summary['hedges']} hedges, {summary['failed']} failed")
+    if summary['failed'] == 0:
+        batch_status = 'completed'
+    elif summary['failed'] == total:
+        batch_status = 'failed'
+    else:
+        batch_status = 'partial'
+    save_job_status(f"bulk_{batch_id}", batch_status, summary)
+    metrics.publish(redis_conn)
     
     # Send batch completion email
     if notification_email:
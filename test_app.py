@@ -0,0 +1,26 @@
+import pytest
+from app import app
+
+IMAGES = [{'name': 'plant.png', 'url': 'https://example.com/plant.png'}]
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize('hedge', ['false', '0', 0, 1, 'yes'])
+def test_generate_rejects_non_bool_hedge(client, hedge):
+    response = client.post('/api/generate', json={'images': IMAGES, 'hedge': hedge})
+    assert response.status_code == 400
+    assert 'hedge' in response.get_json()['error']
+
+
+def test_generate_rejects_unknown_tier(client):
+    response = client.post('/api/generate', json={'images': IMAGES, 'tier': 'turbo'})
+    assert response.status_code == 400
+
+
+def test_generate_rejects_unsupported_duration(client):
+    response = client.post('/api/generate', json={'images': IMAGES, 'duration': 7})
+    assert response.status_code == 400
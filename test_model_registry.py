@@ -0,0 +1,97 @@
+import pytest
+import replicate
+from model_registry import (
+    ModelRegistry,
+    ModelSpec,
+    LatencyStats,
+    MIN_LATENCY_SAMPLES,
+    STANDARD_LATENCY_SLACK,
+    kling_input,
+    percentile
+)
+
+
+def fake_submit(ref, input):
+    raise AssertionError("offline tests must not submit predictions")
+
+
+def fake_model(name, p95, cost_per_run=0.0, **kwargs):
+    """A local stand-in for a Replicate model, never touches the network"""
+    return ModelSpec(
+        name=name,
+        ref=f"local/{name}",
+        build_input=kling_input,
+        latency={'p50': p95 / 2, 'p95': p95, 'p99': p95 * 1.5},
+        cost_per_run=cost_per_run,
+        submitter=fake_submit,
+        **kwargs
+    )
+
+
+@pytest.fixture
+def registry():
+    registry = ModelRegistry(LatencyStats())
+    registry.register(fake_model('quick', p95=100, cost_per_run=1.0))
+    registry.register(fake_model('cheap', p95=150, cost_per_run=0.2))
+    registry.register(fake_model('slow', p95=1000, cost_per_run=0.1))
+    return registry
+
+
+def test_percentile_nearest_rank():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 99) == 99
+    assert percentile([], 99) is None
+
+
+def test_select_per_tier(registry):
+    assert registry.select('fast').name == 'quick'
+    assert registry.select('economy').name == 'slow'
+    # slow is cheapest but far outside the slack, so standard settles on cheap
+    assert registry.select('standard').name == 'cheap'
+
+
+def test_standard_slack_bounds_eligible_models(registry):
+    registry.register(fake_model('slow', p95=100 * STANDARD_LATENCY_SLACK, cost_per_run=0.1))
+    assert registry.select('standard').name == 'slow'
+
+
+def test_declared_latency_until_enough_samples(registry):
+    for _ in range(MIN_LATENCY_SAMPLES - 1):
+        registry.record_latency('cheap', 10)
+    assert registry.latency('cheap', 95) == 150
+    assert registry.select('fast').name == 'quick'
+
+    registry.record_latency('cheap', 10)
+    assert registry.latency('cheap', 95) == 10
+    assert registry.select('fast').name == 'cheap'
+
+
+def test_register_replaces_entry(registry):
+    registry.register(fake_model('quick', p95=5000, cost_per_run=1.0))
+    assert registry.get('quick').latency['p95'] == 5000
+    assert registry.select('fast').name == 'cheap'
+
+
+def test_unsupported_settings_are_not_routed(registry):
+    registry.register(fake_model('square', p95=1, cost_per_run=0.0, aspect_ratios=('1:1',)))
+    assert registry.select('fast', {'aspect_ratio': '1:1'}).name == 'square'
+    assert registry.select('fast', {'aspect_ratio': '16:9'}).name == 'quick'
+
+
+def test_no_model_supports_settings():
+    registry = ModelRegistry(LatencyStats())
+    registry.register(fake_model('kling-like', p95=100, durations=(5, 10)))
+    with pytest.raises(LookupError):
+        registry.select('standard', {'duration': 7})
+
+
+def test_unknown_tier_rejected(registry):
+    with pytest.raises(ValueError):
+        registry.select('turbo')
+
+
+def test_pinned_client_supports_versionless_models():
+    # kling-v1.6-pro has no version hash and is created via models.predictions
+    assert callable(replicate.models.predictions.create)
+    assert callable(replicate.predictions.create)
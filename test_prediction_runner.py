@@ -0,0 +1,335 @@
+import pytest
+import prediction_runner
+from model_registry import ModelRegistry, ModelSpec, LatencyStats, kling_input
+from prediction_runner import (
+    BatchMetrics,
+    HedgeBudget,
+    PredictionTimeout,
+    run_with_deadline,
+    deadline_for
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakePrediction:
+    """
+    Finishes `duration` seconds after submission with `outcome` unless cancelled;
+    outcome 'unreachable' makes reload() raise from then on
+    """
+
+    def __init__(self, clock, id, duration, outcome='succeeded'):
+        self.clock = clock
+        self.id = id
+        self.started = clock()
+        self.duration = duration
+        self.outcome = outcome
+        self.status = 'starting'
+        self.output = None
+        self.error = None
+        self.cancelled = False
+
+    def reload(self):
+        if self.cancelled or self.status in prediction_runner.FINISHED:
+            return
+        if self.clock() - self.started >= self.duration:
+            if self.outcome == 'unreachable':
+                raise ConnectionError("connection reset")
+            self.status = self.outcome
+            if self.outcome == 'succeeded':
+                self.output = f"https://example.com/{self.id}.mp4"
+            else:
+                self.error = f"prediction {self.id} failed"
+        else:
+            self.status = 'processing'
+
+    def cancel(self):
+        self.cancelled = True
+        self.status = 'canceled'
+
+
+class FakeModel:
+    """
+    Hands out FakePredictions with scripted (duration, outcome) pairs;
+    ('raise', message) makes that submission fail instead
+    """
+
+    def __init__(self, clock, script):
+        self.clock = clock
+        self.script = list(script)
+        self.submitted = []
+
+    def submit(self, ref, input):
+        duration, outcome = self.script.pop(0)
+        if duration == 'raise':
+            raise Exception(outcome)
+        prediction = FakePrediction(self.clock, len(self.submitted) + 1, duration, outcome)
+        self.submitted.append(prediction)
+        return prediction
+
+
+class FakeRedis:
+    """Just enough of redis-py for the shared hedge budget"""
+
+    def __init__(self):
+        self.values = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def decr(self, key):
+        self.values[key] -= 1
+        return self.values[key]
+
+    def expire(self, key, seconds):
+        return True
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def incr(self, key):
+        self.calls.append(('incr', key))
+
+    def expire(self, key, seconds):
+        self.calls.append(('expire', key, seconds))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args) for name, *args in self.calls]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_registry(fake, cost_per_run=1.0):
+    registry = ModelRegistry(LatencyStats())
+    registry.register(ModelSpec(
+        name='fake',
+        ref='local/fake',
+        build_input=kling_input,
+        latency={'p50': 50, 'p95': 80, 'p99': 100},
+        cost_per_run=cost_per_run,
+        submitter=fake.submit
+    ))
+    return registry
+
+
+def run(registry, clock, **kwargs):
+    return run_with_deadline(
+        registry.get('fake'), registry, 'https://example.com/in.png', {},
+        clock=clock, sleep=clock.sleep, **kwargs
+    )
+
+
+def ok(duration):
+    return (duration, 'succeeded')
+
+
+def test_deadline_uses_p99_with_headroom(clock):
+    registry = make_registry(FakeModel(clock, []))
+    assert deadline_for(registry, registry.get('fake')) == 100 * prediction_runner.DEADLINE_FACTOR
+
+
+def test_fast_prediction_needs_no_intervention(clock):
+    fake = FakeModel(clock, [ok(40)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1')
+
+    assert run(registry, clock, metrics=metrics, budget=HedgeBudget(5)) == "https://example.com/1.mp4"
+    assert len(fake.submitted) == 1
+    assert registry.stats.samples('fake') == [40]
+    assert (metrics.timeouts, metrics.retries, metrics.hedges) == (0, 0, 0)
+
+
+def test_hedge_wins_and_loser_is_cancelled(clock):
+    fake = FakeModel(clock, [ok(1000), ok(50)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1', hedging=True)
+
+    output = run(registry, clock, metrics=metrics, budget=HedgeBudget(5), hedge=True)
+
+    primary, hedge = fake.submitted
+    assert output == "https://example.com/2.mp4"
+    assert primary.cancelled and not hedge.cancelled
+    assert (metrics.hedges, metrics.hedge_wins, metrics.retries, metrics.timeouts) == (1, 1, 0, 1)
+    assert metrics.extra_cost == 1.0
+
+
+def test_failed_hedge_leaves_primary_running(clock):
+    fake = FakeModel(clock, [ok(200), (0, 'failed')])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1', hedging=True)
+
+    output = run(registry, clock, metrics=metrics, budget=HedgeBudget(5), hedge=True)
+
+    assert output == "https://example.com/1.mp4"
+    assert not fake.submitted[0].cancelled
+    assert (metrics.hedges, metrics.hedge_wins, metrics.timeouts) == (1, 0, 1)
+
+
+def test_both_stuck_after_hedge_are_cancelled_and_retried(clock):
+    fake = FakeModel(clock, [ok(1000), ok(1000), ok(50)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1', hedging=True)
+
+    output = run(registry, clock, metrics=metrics, budget=HedgeBudget(5), hedge=True)
+
+    assert output == "https://example.com/3.mp4"
+    assert fake.submitted[0].cancelled and fake.submitted[1].cancelled
+    assert (metrics.hedges, metrics.retries, metrics.timeouts) == (1, 1, 2)
+    assert metrics.extra_cost == 2.0
+
+
+def test_stuck_prediction_is_retried(clock):
+    fake = FakeModel(clock, [ok(1000), ok(50)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1')
+
+    assert run(registry, clock, metrics=metrics, budget=HedgeBudget(5)) == "https://example.com/2.mp4"
+    assert fake.submitted[0].cancelled
+    assert (metrics.retries, metrics.timeouts, metrics.hedges) == (1, 1, 0)
+
+
+def test_exhausted_budget_waits_instead_of_cancelling(clock):
+    fake = FakeModel(clock, [ok(200)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1')
+
+    assert run(registry, clock, metrics=metrics, budget=HedgeBudget(0)) == "https://example.com/1.mp4"
+    assert not fake.submitted[0].cancelled
+    assert (metrics.retries, metrics.timeouts, metrics.budget_refusals) == (0, 1, 1)
+
+
+def test_cost_cap_refuses_extra_submissions(clock):
+    fake = FakeModel(clock, [ok(200)])
+    registry = make_registry(fake, cost_per_run=1.0)
+    metrics = BatchMetrics('b1', hedging=True)
+
+    budget = HedgeBudget(5, max_cost=0.5)
+    assert run(registry, clock, metrics=metrics, budget=budget, hedge=True) == "https://example.com/1.mp4"
+    assert len(fake.submitted) == 1
+    assert (budget.used, metrics.hedges, metrics.budget_refusals) == (0, 0, 1)
+
+
+def test_exhausted_retries_wait_instead_of_cancelling(clock, monkeypatch):
+    monkeypatch.setattr(prediction_runner, 'MAX_RETRIES', 1)
+    fake = FakeModel(clock, [ok(1000), ok(300)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1')
+
+    assert run(registry, clock, metrics=metrics, budget=HedgeBudget(5)) == "https://example.com/2.mp4"
+    assert len(fake.submitted) == 2
+    assert (metrics.retries, metrics.timeouts, metrics.budget_refusals) == (1, 2, 1)
+
+
+def test_hard_deadline_gives_up(clock):
+    fake = FakeModel(clock, [ok(100000)])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1')
+
+    with pytest.raises(PredictionTimeout):
+        run(registry, clock, metrics=metrics, budget=HedgeBudget(0))
+
+    hard_deadline = deadline_for(registry, registry.get('fake')) * prediction_runner.HARD_DEADLINE_FACTOR
+    assert fake.submitted[0].cancelled
+    assert hard_deadline < clock() <= hard_deadline + prediction_runner.POLL_INTERVAL
+    assert metrics.timeouts == 1
+
+
+def test_failed_prediction_raises(clock):
+    fake = FakeModel(clock, [(10, 'failed')])
+    registry = make_registry(fake)
+
+    with pytest.raises(Exception, match="prediction 1 failed"):
+        run(registry, clock, budget=HedgeBudget(5))
+
+
+def test_budget_count_cap():
+    budget = HedgeBudget(2, max_cost=100)
+    assert budget.take(1.0) and budget.take(1.0)
+    assert not budget.take(1.0)
+    assert (budget.used, budget.spent) == (2, 2.0)
+
+
+def test_budget_shared_across_workers():
+    redis_conn = FakeRedis()
+    first = HedgeBudget(5, redis_conn=redis_conn, max_per_minute=1)
+    second = HedgeBudget(5, redis_conn=redis_conn, max_per_minute=1)
+
+    assert first.take(1.0)
+    assert not second.take(1.0)
+    assert second.used == 0
+    assert list(redis_conn.values.values()) == [1]
+
+
+def test_batch_metrics_summary():
+    metrics = BatchMetrics('b1', hedging=True)
+    for seconds in range(1, 101):
+        metrics.record_job(seconds)
+    metrics.hedges = 2
+    metrics.hedge_wins = 1
+    metrics.extra_cost = 0.123456
+
+    summary = metrics.summary()
+    assert summary['jobs'] == 100
+    assert summary['p50_seconds'] == 50
+    assert summary['p99_seconds'] == 99
+    assert summary['max_seconds'] == 100
+    assert summary['hedges'] == 2 and summary['hedge_wins'] == 1
+    assert summary['extra_cost'] == 0.1235
+    assert summary['hedging'] is True
+
+
+def test_empty_batch_summary():
+    summary = BatchMetrics('b1').summary()
+    assert summary['jobs'] == 0
+    assert summary['p99_seconds'] is None and summary['max_seconds'] is None
+
+
+def test_failed_hedge_submit_keeps_primary(clock):
+    fake = FakeModel(clock, [ok(200), ('raise', '429 Too Many Requests')])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1', hedging=True)
+    budget = HedgeBudget(5)
+
+    assert run(registry, clock, metrics=metrics, budget=budget, hedge=True) == "https://example.com/1.mp4"
+    assert not fake.submitted[0].cancelled
+    assert (metrics.hedges, metrics.extra_cost, budget.used) == (0, 0.0, 0)
+
+
+def test_failed_resubmit_keeps_current_prediction(clock):
+    fake = FakeModel(clock, [ok(200), ('raise', '429 Too Many Requests')])
+    registry = make_registry(fake)
+    metrics = BatchMetrics('b1')
+    budget = HedgeBudget(5)
+
+    assert run(registry, clock, metrics=metrics, budget=budget) == "https://example.com/1.mp4"
+    assert not fake.submitted[0].cancelled
+    assert (metrics.retries, metrics.extra_cost, budget.used) == (0, 0.0, 0)
+
+
+def test_reload_error_cancels_every_active_prediction(clock):
+    fake = FakeModel(clock, [ok(1000), (10, 'unreachable')])
+    registry = make_registry(fake)
+
+    with pytest.raises(ConnectionError):
+        run(registry, clock, budget=HedgeBudget(5), hedge=True)
+
+    assert all(prediction.cancelled for prediction in fake.submitted)
@@ -0,0 +1,18 @@
+import tasks
+
+
+def test_rejected_jobs_do_not_count_towards_completion_times(monkeypatch):
+    statuses = {}
+    monkeypatch.setattr(tasks, 'save_job_status', lambda job_id, status, data=None: statuses.update({job_id: (status, data)}))
+    monkeypatch.setattr(tasks, 'process_video', lambda *args, **kwargs: {'video_url': 'https://example.com/out.mp4'})
+    monkeypatch.setattr(tasks.BatchMetrics, 'publish', lambda self, redis_conn: None)
+
+    results = tasks.process_bulk_videos(
+        [{'name': 'ok', 'url': 'https://example.com/in.png'}, {'name': 'empty', 'url': ''}],
+        {'prompt': 'pan'}
+    )
+
+    assert 'error' in results[1]
+    (status, summary), = statuses.values()
+    assert status == 'partial'
+    assert (summary['jobs'], summary['rejected'], summary['failed']) == (1, 1, 1)